@@ -23,8 +23,13 @@ Function summary
         to_file
         player_for
 """
+import io
 import os
 import sys
+import shutil
+import struct
+import subprocess
+import threading
 import wave
 import warnings
 from abc import ABC, abstractmethod
@@ -38,6 +43,21 @@ try:
 except ImportError:
     _WITH_PYDUB = False
 
+_WITH_FFMPEG = (
+    shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+)
+# PCM codec used by ffmpeg to decode each sample format reported by ffprobe.
+# 24-bit audio is reported as "s32". Other formats (16-bit and floating point
+# samples) are decoded to 16-bit PCM.
+_FFMPEG_PCM_CODECS = {
+    "u8": "pcm_u8",
+    "u8p": "pcm_u8",
+    "s32": "pcm_s32le",
+    "s32p": "pcm_s32le",
+    "s64": "pcm_s32le",
+    "s64p": "pcm_s32le",
+}
+
 try:
     from tqdm import tqdm as _tqdm
 
@@ -68,11 +88,15 @@ DEFAULT_SAMPLING_RATE = 16000
 DEFAULT_SAMPLE_WIDTH = 2
 DEFAULT_NB_CHANNELS = 1
 
+# size of data chunks written to disk by `_save_raw`
+_WRITE_CHUNK_SIZE = 1 << 22
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
 
 def check_audio_data(data, sample_width, channels):
-    sample_size_bytes = int(sample_width * channels)
-    nb_samples = len(data) // sample_size_bytes
-    if nb_samples * sample_size_bytes != len(data):
+    sample_size_bytes = sample_width * channels
+    if len(data) % sample_size_bytes:
         raise AudioParameterError(
             "The length of audio data must be an integer "
             "multiple of `sample_width * channels`"
@@ -86,12 +110,78 @@ def _guess_audio_format(fmt, filename):
             fmt = extension
         else:
             return None
-    fmt == fmt.lower()
+    fmt = fmt.lower()
     if fmt == "wave":
         fmt = "wav"
     return fmt
 
 
+def _parse_wav_header(fp):
+    """
+    Parse the header of a wave file and return its audio parameters as well
+    as the position and the size of audio data in the file. `fp` should be
+    a binary file object positioned at the beginning of the file.
+
+    Data size is clamped to the actual size of the file and truncated to a
+    whole number of frames, which matches what `wave.readframes` returns.
+
+    :Returns:
+        wave_parameters: tuple
+            (sampling_rate, sample_width, channels, data_offset, data_size)
+    """
+    header = fp.read(12)
+    if len(header) < 12:
+        raise AudioIOError("File too short to be a valid wave file")
+    riff_id, _, wave_id = struct.unpack("<4sI4s", header)
+    if riff_id != b"RIFF" or wave_id != b"WAVE":
+        raise AudioIOError("File is not a valid RIFF/WAVE file")
+    fmt = None
+    while True:
+        chunk_header = fp.read(8)
+        if len(chunk_header) < 8:
+            raise AudioIOError("No 'data' chunk found in wave file")
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+        if chunk_id == b"fmt ":
+            fmt_chunk = fp.read(chunk_size)
+            if len(fmt_chunk) < 16:
+                raise AudioIOError("Invalid 'fmt ' chunk in wave file")
+            # skip byte rate and block align
+            params = struct.unpack("<HHI6xH", fmt_chunk[:16])
+            format_tag, channels, sampling_rate, bits_per_sample = params
+            if format_tag == _WAVE_FORMAT_EXTENSIBLE:
+                # actual format is given by the first two bytes of SubFormat
+                if len(fmt_chunk) < 26:
+                    raise AudioIOError("Invalid 'fmt ' chunk in wave file")
+                format_tag = struct.unpack("<H", fmt_chunk[24:26])[0]
+            if format_tag != _WAVE_FORMAT_PCM:
+                raise AudioIOError(
+                    "Unsupported wave format: {}".format(format_tag)
+                )
+            if channels == 0 or bits_per_sample == 0:
+                raise AudioIOError("Invalid audio parameters in wave file")
+            sample_width = (bits_per_sample + 7) // 8
+            fmt = (sampling_rate, sample_width, channels)
+            # chunks are word-aligned
+            fp.seek(chunk_size & 1, os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise AudioIOError("No 'fmt ' chunk found before 'data'")
+            sampling_rate, sample_width, channels = fmt
+            data_offset = fp.tell()
+            file_size = fp.seek(0, os.SEEK_END)
+            data_size = min(chunk_size, file_size - data_offset)
+            data_size -= data_size % (sample_width * channels)
+            return (
+                sampling_rate,
+                sample_width,
+                channels,
+                data_offset,
+                data_size,
+            )
+        else:
+            fp.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
 def _get_audio_parameters(param_dict):
     """
     Gets audio parameters from a dictionary of parameters.
@@ -224,7 +314,7 @@ class AudioSource(ABC):
     @property
     def ch(self):
         """ Return the number of channels of this audio source """
-        return self.channels
+        return self._channels
 
 
 class Rewindable(AudioSource):
@@ -294,7 +384,9 @@ class BufferAudioSource(Rewindable):
         AudioSource.__init__(self, sampling_rate, sample_width, channels)
         check_audio_data(data, sample_width, channels)
         self._data = data
+        self._data_size_bytes = len(data)
         self._sample_size_all_channels = sample_width * channels
+        self._bytes_per_second = self._sample_size_all_channels * sampling_rate
         self._current_position_bytes = 0
         self._is_open = False
 
@@ -338,17 +430,15 @@ class BufferAudioSource(Rewindable):
     def position(self, position):
         position *= self._sample_size_all_channels
         if position < 0:
-            position += len(self.data)
-        if position < 0 or position > len(self.data):
+            position += self._data_size_bytes
+        if position < 0 or position > self._data_size_bytes:
             raise IndexError("Position out of range")
         self._current_position_bytes = position
 
     @property
     def position_ms(self):
         """Stream position in milliseconds"""
-        return (self._current_position_bytes * 1000) // (
-            self._sample_size_all_channels * self.sampling_rate
-        )
+        return (self._current_position_bytes * 1000) // self._bytes_per_second
 
     @position_ms.setter
     def position_ms(self, position_ms):
@@ -422,23 +512,34 @@ class WaveAudioSource(FileAudioSource):
     def __init__(self, filename):
         self._filename = filename
         self._audio_stream = None
-        stream = wave.open(self._filename, "rb")
-        FileAudioSource.__init__(
-            self,
-            stream.getframerate(),
-            stream.getsampwidth(),
-            stream.getnchannels(),
-        )
-        stream.close()
+        # header is parsed only once, `open` reuses data position and size
+        with open(self._filename, "rb") as fp:
+            (
+                sampling_rate,
+                sample_width,
+                channels,
+                self._data_offset,
+                data_size,
+            ) = _parse_wav_header(fp)
+        FileAudioSource.__init__(self, sampling_rate, sample_width, channels)
+        self._data_end = self._data_offset + data_size
+        self._sample_size = sample_width * channels
 
     def open(self):
         if self._audio_stream is None:
-            self._audio_stream = wave.open(self._filename)
+            self._audio_stream = open(self._filename, "rb")
+            self._audio_stream.seek(self._data_offset)
+            self._current_position_bytes = self._data_offset
 
     def _read_from_stream(self, size):
+        bytes_left = self._data_end - self._current_position_bytes
         if size is None or size < 0:
-            size = -1
-        return self._audio_stream.readframes(size)
+            bytes_to_read = bytes_left
+        else:
+            bytes_to_read = min(size * self._sample_size, bytes_left)
+        data = self._audio_stream.read(bytes_to_read)
+        self._current_position_bytes += len(data)
+        return data
 
 
 class PyAudioSource(AudioSource):
@@ -528,7 +629,11 @@ class StdinAudioSource(FileAudioSource):
         self._is_open = False
 
     def _read_from_stream(self, size):
-        bytes_to_read = size * self._sample_size
+        if size is None or size < 0:
+            # read all available data
+            bytes_to_read = -1
+        else:
+            bytes_to_read = size * self._sample_size
         data = self._stream.read(bytes_to_read)
         if data:
             return data
@@ -565,8 +670,18 @@ class PyAudioPlayer:
         self.sample_width = sample_width
         self.channels = channels
 
+        # play audio in chunks of 100 ms, each chunk is a multiple of
+        # sample_width * channels
+        self._frame_size = self.sample_width * self.channels
+        self._chunk_size = max(self.sampling_rate // 10, 1) * self._frame_size
+        self._data = b""
+        self._position = 0
+        self._done = threading.Event()
+
         import pyaudio
 
+        self._pa_continue = pyaudio.paContinue
+        self._pa_complete = pyaudio.paComplete
         self._p = pyaudio.PyAudio()
         self.stream = self._p.open(
             format=self._p.get_format_from_width(self.sample_width),
@@ -574,28 +689,44 @@ class PyAudioPlayer:
             rate=self.sampling_rate,
             input=False,
             output=True,
+            frames_per_buffer=self._chunk_size // self._frame_size,
+            start=False,
+            stream_callback=self._callback,
         )
 
     def play(self, data, progress_bar=False, **progress_bar_kwargs):
-        chunk_gen, nb_chunks = self._chunk_data(data)
+        # PyAudio only accepts `bytes` chunks from the callback, slicing
+        # `bytes` already returns `bytes` (`bytes` doesn't copy if `data` is
+        # already a `bytes` object)
+        data = bytes(data)
+        if not data:
+            return
+        nb_chunks, rest = divmod(len(data), self._chunk_size)
+        if rest > 0:
+            nb_chunks += 1
+        pbar = None
         if progress_bar and _WITH_TQDM:
-            duration = len(data) / (
-                self.sampling_rate * self.sample_width * self.channels
+            duration = len(data) / (self.sampling_rate * self._frame_size)
+            pbar = make_tqdm_progress_bar(
+                None, total=nb_chunks, duration=duration, **progress_bar_kwargs
             )
-            chunk_gen = make_tqdm_progress_bar(
-                chunk_gen,
-                total=nb_chunks,
-                duration=duration,
-                **progress_bar_kwargs
-            )
-        if self.stream.is_stopped():
-            self.stream.start_stream()
+        self._data = data
+        self._position = 0
+        self._done.clear()
+        self.stream.start_stream()
+        played_chunks = 0
         try:
-            for chunk in chunk_gen:
-                self.stream.write(chunk)
+            # wake up every 100 ms to update progress bar and to allow
+            # interruption (like ctrl+c). Also stop waiting if PortAudio
+            # stopped the stream before all data was played
+            while self.stream.is_active() and not self._done.wait(0.1):
+                played_chunks = self._update_progress_bar(pbar, played_chunks)
         except KeyboardInterrupt:
             pass
+        self._update_progress_bar(pbar, played_chunks)
         self.stream.stop_stream()
+        if pbar is not None:
+            pbar.close()
 
     def stop(self):
         if not self.stream.is_stopped():
@@ -603,19 +734,24 @@ class PyAudioPlayer:
         self.stream.close()
         self._p.terminate()
 
-    def _chunk_data(self, data):
-        # make audio chunks of 100 ms to allow interruption (like ctrl+c)
-        bytes_1_sec = self.sampling_rate * self.sample_width * self.channels
-        chunk_size = bytes_1_sec // 10
-        # make sure chunk_size is a multiple of sample_width * channels
-        chunk_size -= chunk_size % (self.sample_width * self.channels)
-        nb_chunks, rest = divmod(len(data), chunk_size)
-        if rest > 0:
-            nb_chunks += 1
-        chunk_gen = (
-            data[i : i + chunk_size] for i in range(0, len(data), chunk_size)
-        )
-        return chunk_gen, nb_chunks
+    def _callback(self, in_data, frame_count, time_info, status):
+        """Called by PyAudio from its own thread whenever it needs more
+        data to play."""
+        start = self._position
+        self._position += frame_count * self._frame_size
+        chunk = self._data[start : self._position]
+        if self._position >= len(self._data):
+            self._done.set()
+            return chunk, self._pa_complete
+        return chunk, self._pa_continue
+
+    def _update_progress_bar(self, pbar, played_chunks):
+        if pbar is None:
+            return played_chunks
+        position = min(self._position, len(self._data))
+        new_played_chunks = -(-position // self._chunk_size)
+        pbar.update(new_played_chunks - played_chunks)
+        return new_played_chunks
 
 
 def player_for(source):
@@ -728,11 +864,95 @@ def _load_wave(filename, large_file=False):
     """
     if large_file:
         return WaveAudioSource(filename)
-    with wave.open(filename) as fp:
-        channels = fp.getnchannels()
-        srate = fp.getframerate()
-        swidth = fp.getsampwidth()
-        data = fp.readframes(-1)
+    with open(filename, "rb") as fp:
+        srate, swidth, channels, data_offset, data_size = _parse_wav_header(fp)
+        fp.seek(data_offset)
+        data = fp.read(data_size)
+    return BufferAudioSource(
+        data, sampling_rate=srate, sample_width=swidth, channels=channels
+    )
+
+
+def _run_command(command):
+    """Run `command` and return its exit status and standard output.
+    Standard error is discarded. `subprocess.run` is not used because it is
+    not available on Python 3.4."""
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    output, _ = process.communicate()
+    return process.returncode, output
+
+
+def _get_ffmpeg_pcm_codec(filename, audio_format=None):
+    """Return the PCM codec ffmpeg should use to decode the first audio
+    stream of `filename` without reducing its bit depth. Sample format of
+    the stream is read using ffprobe.
+    """
+    command = ["ffprobe", "-v", "quiet"]
+    if audio_format is not None:
+        command += ["-f", audio_format]
+    command += [
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=sample_fmt",
+        "-of",
+        "csv=p=0",
+        filename,
+    ]
+    returncode, output = _run_command(command)
+    sample_format = output.decode(errors="replace").strip()
+    if returncode != 0 or not sample_format:
+        raise AudioIOError("No audio stream found in '{}'".format(filename))
+    return _FFMPEG_PCM_CODECS.get(sample_format, "pcm_s16le")
+
+
+def _load_with_ffmpeg(filename, audio_format=None):
+    """Decode audio file using ffmpeg. If a video file is passed, its audio
+    track is extracted and loaded. Audio data is decoded to PCM and read from
+    a pipe, keeping the file's sampling rate and number of channels.
+    This function should not be called directely, use :func:`from_file`
+    instead.
+
+    8-bit and 16-bit integer audio keep their sample width, 24-bit and 32-bit
+    integer audio (e.g. from flac) are decoded to 32-bit samples. Codecs that
+    decode to floating point samples (e.g. mp3, ogg, aac) are decoded to
+    16-bit samples.
+
+    :Parameters:
+
+    `filename`:
+        path to audio file.
+    `audio_format`:
+        string, input format passed to ffmpeg (e.g. ogg, mp3, flac). If None,
+        format is detected by ffmpeg from file's content.
+    """
+    codec = _get_ffmpeg_pcm_codec(filename, audio_format)
+    command = ["ffmpeg", "-v", "quiet"]
+    if audio_format is not None:
+        command += ["-f", audio_format]
+    command += [
+        "-i",
+        filename,
+        "-vn",
+        "-map_metadata",
+        "-1",
+        "-acodec",
+        codec,
+        "-f",
+        "wav",
+        "pipe:1",
+    ]
+    returncode, wave_data = _run_command(command)
+    if returncode != 0:
+        raise AudioIOError("ffmpeg could not decode '{}'".format(filename))
+    # header sizes aren't known when ffmpeg writes to a pipe, actual data
+    # size is deduced from the size of the output
+    srate, swidth, channels, data_offset, data_size = _parse_wav_header(
+        io.BytesIO(wave_data)
+    )
+    data = wave_data[data_offset : data_offset + data_size]
     return BufferAudioSource(
         data, sampling_rate=srate, sample_width=swidth, channels=channels
     )
@@ -771,8 +991,9 @@ def from_file(filename, audio_format=None, large_file=False, **kwargs):
     Read audio data from `filename` and return an `AudioSource` object.
     if `audio_format` is None, the appropriate :class:`AudioSource` class is
     guessed from file's extension. `filename` can be a compressed audio or
-    video file. This will require installing pydub:
-    (https://github.com/jiaaro/pydub).
+    video file. This will require installing ffmpeg and ffprobe
+    (https://ffmpeg.org), which are used to decode audio directly, or pydub
+    (https://github.com/jiaaro/pydub) if ffmpeg is not found.
 
     The normal behavior is to load all audio data to memory from which a
     :class:`BufferAudioSource` object is created. This should be convenient
@@ -816,6 +1037,7 @@ def from_file(filename, audio_format=None, large_file=False, **kwargs):
     An `AudioIOError` is raised if audio data cannot be read in the given
     format; or if format is `raw` and one or more audio parameters are missing.
     """
+    format_given = audio_format is not None
     audio_format = _guess_audio_format(audio_format, filename)
 
     if audio_format == "raw":
@@ -827,11 +1049,17 @@ def from_file(filename, audio_format=None, large_file=False, **kwargs):
     if large_file:
         err_msg = "if 'large_file` is True file format should be raw or wav"
         raise AudioIOError(err_msg)
+    if _WITH_FFMPEG:
+        # unless a format is explicitly given, let ffmpeg detect it from
+        # file's content rather than from its extension
+        input_format = audio_format if format_given else None
+        return _load_with_ffmpeg(filename, input_format)
     if _WITH_PYDUB:
         return _load_with_pydub(filename, audio_format=audio_format)
     else:
         raise AudioIOError(
-            "pydub is required for audio formats other than raw or wav"
+            "ffmpeg or pydub is required for audio formats other than raw or "
+            "wav"
         )
 
 
@@ -840,8 +1068,13 @@ def _save_raw(data, file):
     Saves audio data as a headerless (i.e. raw) file.
     See also :func:`to_file`.
     """
-    with open(file, "wb") as fp:
-        fp.write(data)
+    data = memoryview(data).cast("B")
+    # unbuffered writes go straight from `data` to the OS without copying it
+    # to an intermediate buffer. Write in chunks to handle partial writes.
+    with open(file, "wb", buffering=0) as fp:
+        written = 0
+        while written < len(data):
+            written += fp.write(data[written : written + _WRITE_CHUNK_SIZE])
 
 
 def _save_wave(data, file, sampling_rate, sample_width, channels):
@@ -916,7 +1149,7 @@ def to_file(data, file, audio_format=None, **kwargs):
         sampling_rate, sample_width, channels = _get_audio_parameters(kwargs)
     except AudioParameterError as exc:
         err_message = "All audio parameters are required to save formats "
-        "other than raw. Error detail: {}".format(exc)
+        err_message += "other than raw. Error detail: {}".format(exc)
         raise AudioParameterError(err_message)
     if audio_format in ("wav", "wave"):
         _save_wave(data, file, sampling_rate, sample_width, channels)
@@ -20,13 +20,10 @@ def extract_single_channel(data, fmt, channels, selected):
 
 def average_channels(data, fmt, channels):
     all_channels = array(fmt, data)
-    mono_channels = [
-        array(fmt, all_channels[ch::channels]) for ch in range(channels)
-    ]
-    avg_arr = array(
-        fmt,
-        (round(sum(samples) / channels) for samples in zip(*mono_channels)),
-    )
+    # slicing an array already returns a new array
+    mono_channels = [all_channels[ch::channels] for ch in range(channels)]
+    totals = map(sum, zip(*mono_channels))
+    avg_arr = array(fmt, [round(total / channels) for total in totals])
     return avg_arr
 
 
@@ -38,9 +35,7 @@ def average_channels_stereo(data, sample_width):
 
 def separate_channels(data, fmt, channels):
     all_channels = array(fmt, data)
-    mono_channels = [
-        array(fmt, all_channels[ch::channels]) for ch in range(channels)
-    ]
+    mono_channels = [all_channels[ch::channels] for ch in range(channels)]
     return mono_channels
 
 
@@ -12,19 +12,25 @@ def to_array(data, sample_width, channels):
     fmt = FORMAT[sample_width]
     if channels == 1:
         return np.frombuffer(data, dtype=fmt).astype(np.float64)
-    return separate_channels(data, fmt, channels).astype(np.float64)
+    # cast the strided (channels, N) view in one pass instead of making
+    # a contiguous integer copy first and then a float copy of it
+    array = np.frombuffer(data, dtype=fmt).reshape(-1, channels)
+    return array.T.astype(np.float64, order="C")
 
 
 def extract_single_channel(data, fmt, channels, selected):
-    samples = np.frombuffer(data, dtype=fmt)
-    return np.asanyarray(samples[selected::channels], order="C")
+    samples = np.frombuffer(data, dtype=fmt).reshape(-1, channels)
+    return np.ascontiguousarray(samples[:, selected])
 
 
 def average_channels(data, fmt, channels):
-    array = np.frombuffer(data, dtype=fmt).astype(np.float64)
-    return array.reshape(-1, channels).mean(axis=1).round().astype(fmt)
+    array = np.frombuffer(data, dtype=fmt).reshape(-1, channels)
+    # sum up channels as integers so that only the (mono) sum is converted
+    # to float rather than the whole multichannel signal
+    total = array.sum(axis=1, dtype=np.int64)
+    return np.round(total / channels).astype(fmt)
 
 
 def separate_channels(data, fmt, channels):
     array = np.frombuffer(data, dtype=fmt)
-    return np.asanyarray(array.reshape(-1, channels).T, order="C")
+    return np.ascontiguousarray(array.reshape(-1, channels).T)
@@ -2,13 +2,19 @@
 @author: Amine Sehili <amine.sehili@gmail.com>
 """
 from array import array
+import io
+import os
+import shutil
 import unittest
+from unittest.mock import patch
+from tempfile import TemporaryDirectory
 from genty import genty, genty_dataset
 from auditok.io import (
     AudioParameterError,
     BufferAudioSource,
     RawAudioSource,
     WaveAudioSource,
+    StdinAudioSource,
 )
 from auditok.signal import FORMAT
 from test_util import PURE_TONE_DICT, _sample_generator
@@ -108,6 +114,48 @@ class TestAudioSource(unittest.TestCase):
         audio_source.close()
         self.assertEqual(data_read_all, expected)
 
+    def test_WaveAudioSource_truncated_file(self):
+        tmpdir = TemporaryDirectory()
+        file = os.path.join(tmpdir.name, "audio.wav")
+        shutil.copyfile(
+            "tests/data/test_16KHZ_3channel_400-800-1600Hz.wav", file
+        )
+        audio_source = WaveAudioSource(file)
+        audio_source.open()
+        first_block = audio_source.read(1000)
+        # file truncated while being read: 500 samples left after first block
+        sample_size = audio_source.sample_width * audio_source.channels
+        os.truncate(file, 44 + 1500 * sample_size)
+        second_block = audio_source.read(1000)
+        third_block = audio_source.read(1000)
+        audio_source.close()
+        tmpdir.cleanup()
+        mono_channels = [PURE_TONE_DICT[freq] for freq in (400, 800, 1600)]
+        fmt = FORMAT[audio_source.sample_width]
+        expected = array(fmt, _sample_generator(*mono_channels)).tobytes()
+        self.assertEqual(first_block, expected[: 1000 * sample_size])
+        self.assertEqual(
+            second_block, expected[1000 * sample_size : 1500 * sample_size]
+        )
+        self.assertIsNone(third_block)
+
+    @genty_dataset(
+        mono=("mono_400Hz", (400,)),
+        multichannel=("3channel_400-800-1600Hz", (400, 800, 1600)),
+    )
+    def test_StdinAudioSource(self, file_suffix, frequencies):
+        file = "tests/data/test_16KHZ_{}.raw".format(file_suffix)
+        with open(file, "rb") as fp:
+            expected = fp.read()
+        channels = len(frequencies)
+        with patch("sys.stdin") as stdin:
+            stdin.buffer = io.BytesIO(expected)
+            audio_source = StdinAudioSource(16000, 2, channels)
+        audio_source.open()
+        data_read_all = b"".join(audio_source_read_all_gen(audio_source))
+        audio_source.close()
+        self.assertEqual(data_read_all, expected)
+
 
 @genty
 class TestBufferAudioSource_SR10_SW1_CH1(unittest.TestCase):
@@ -3,7 +3,11 @@ import sys
 import math
 from array import array
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+import io
+import struct
 import filecmp
+import threading
+import subprocess
 import unittest
 from unittest import TestCase
 from unittest.mock import patch, Mock
@@ -17,12 +21,16 @@ from auditok.io import (
     RawAudioSource,
     WaveAudioSource,
     StdinAudioSource,
+    PyAudioPlayer,
+    _WITH_FFMPEG,
     check_audio_data,
     _guess_audio_format,
     _get_audio_parameters,
     _load_raw,
     _load_wave,
     _load_with_pydub,
+    _load_with_ffmpeg,
+    _parse_wav_header,
     get_audio_source,
     from_file,
     _save_raw,
@@ -59,6 +67,9 @@ class TestIO(TestCase):
         no_format_no_extension=(None, "filename", None),
         wave_as_wav=("wave", "filename", "wav"),
         wave_as_wav_extension=(None, "filename.wave", "wav"),
+        upper_case_format=("WAV", "filename", "wav"),
+        upper_case_wave_format=("WAVE", "filename.mp3", "wav"),
+        upper_case_extension=(None, "filename.RAW", "raw"),
     )
     def test_guess_audio_format(self, fmt, filename, expected):
         result = _guess_audio_format(fmt, filename)
@@ -133,10 +144,27 @@ class TestIO(TestCase):
         funtion_name = "auditok.io." + funtion_name
         if kwargs is None:
             kwargs = {}
-        with patch(funtion_name) as patch_function:
-            from_file(filename, audio_format, **kwargs)
+        with patch("auditok.io._WITH_FFMPEG", False):
+            with patch(funtion_name) as patch_function:
+                from_file(filename, audio_format, **kwargs)
         self.assertTrue(patch_function.called)
 
+    @genty_dataset(
+        no_format_nor_extension=("audio", None),
+        ogg_with_extension=("audio.ogg", None),
+        webm_with_audio_format=("audio", "webm", "webm"),
+        upper_case_audio_format=("audio.mp3", "OGG", "ogg"),
+    )
+    def test_from_file_with_ffmpeg(
+        self, filename, audio_format, expected_format=None
+    ):
+        with patch("auditok.io._WITH_FFMPEG", True):
+            with patch("auditok.io._load_with_ffmpeg") as load_with_ffmpeg:
+                with patch("auditok.io._load_with_pydub") as load_with_pydub:
+                    from_file(filename, audio_format)
+        load_with_ffmpeg.assert_called_with(filename, expected_format)
+        self.assertFalse(load_with_pydub.called)
+
     def test_from_file_large_file_raw(self,):
         filename = "tests/data/test_16KHZ_mono_400Hz.raw"
         audio_source = from_file(
@@ -169,11 +197,13 @@ class TestIO(TestCase):
             del params[missing_param]
             from_file("audio", audio_format="raw", **params)
 
+    @patch("auditok.io._WITH_FFMPEG", False)
     def test_from_file_no_pydub(self):
         with patch("auditok.io._WITH_PYDUB", False):
             with self.assertRaises(AudioIOError):
                 from_file("audio", "mp3")
 
+    @patch("auditok.io._WITH_FFMPEG", False)
     @patch("auditok.io._WITH_PYDUB", True)
     @patch("auditok.io.BufferAudioSource")
     @genty_dataset(
@@ -267,6 +297,67 @@ class TestIO(TestCase):
         expected = array(fmt, _sample_generator(*mono_channels)).tobytes()
         self.assertEqual(data, expected)
 
+    @genty_dataset(
+        mono=("mono_400", 1),
+        three_channel=("3channel_400-800-1600", 3),
+    )
+    def test_parse_wav_header(self, file_id, channels):
+        filename = "tests/data/test_16KHZ_{}Hz.wav".format(file_id)
+        with open(filename, "rb") as fp:
+            header = _parse_wav_header(fp)
+        srate, swidth, nb_channels, data_offset, data_size = header
+        self.assertEqual((srate, swidth, nb_channels), (16000, 2, channels))
+        self.assertEqual(data_offset, 44)
+        self.assertEqual(data_size, os.path.getsize(filename) - 44)
+
+    def test_parse_wav_header_extra_chunks(self):
+        fmt_chunk = struct.pack("<HHIIHH", 1, 2, 8000, 32000, 4, 16)
+        data = b"\1\2\3\4" * 10 + b"\5"
+        wave_data = b"WAVE"
+        wave_data += b"fmt " + struct.pack("<I", 16) + fmt_chunk
+        # odd-sized chunk followed by a pad byte
+        wave_data += b"LIST" + struct.pack("<I", 3) + b"abc\0"
+        # declared data size bigger than actual data (e.g. truncated file)
+        wave_data += b"data" + struct.pack("<I", 1000) + data
+        wave_data = b"RIFF" + struct.pack("<I", len(wave_data)) + wave_data
+        header = _parse_wav_header(io.BytesIO(wave_data))
+        self.assertEqual(header, (8000, 2, 2, 56, 40))
+
+    def test_parse_wav_header_extensible_pcm(self):
+        # cbSize, valid bits per sample, channel mask and PCM SubFormat GUID
+        extension = struct.pack("<HHI", 22, 16, 3)
+        extension += b"\x01\x00\x00\x00\x00\x00\x10\x00"
+        extension += b"\x80\x00\x00\xaa\x00\x38\x9b\x71"
+        fmt_chunk = struct.pack("<HHIIHH", 0xFFFE, 2, 8000, 32000, 4, 16)
+        fmt_chunk += extension
+        wave_data = b"WAVE"
+        wave_data += b"fmt " + struct.pack("<I", len(fmt_chunk)) + fmt_chunk
+        wave_data += b"data" + struct.pack("<I", 8) + b"\0" * 8
+        wave_data = b"RIFF" + struct.pack("<I", len(wave_data)) + wave_data
+        header = _parse_wav_header(io.BytesIO(wave_data))
+        self.assertEqual(header, (8000, 2, 2, 68, 8))
+
+    @genty_dataset(
+        empty=(b"",),
+        not_riff=(b"RIFX\0\0\0\0WAVE",),
+        no_data_chunk=(b"RIFF\0\0\0\0WAVE",),
+        compressed_format=(
+            b"RIFF\0\0\0\0WAVEfmt \x10\0\0\0\x55\0" + b"\0" * 14,
+        ),
+        extensible_float_format=(
+            b"RIFF\0\0\0\0WAVEfmt \x28\0\0\0\xfe\xff\x01\0"
+            + b"\0" * 20
+            + b"\x03\0"
+            + b"\0" * 14,
+        ),
+        extensible_short_fmt_chunk=(
+            b"RIFF\0\0\0\0WAVEfmt \x10\0\0\0\xfe\xff\x01\0" + b"\0" * 12,
+        ),
+    )
+    def test_parse_wav_header_invalid(self, wave_data):
+        with self.assertRaises(AudioIOError):
+            _parse_wav_header(io.BytesIO(wave_data))
+
     @patch("auditok.io._WITH_PYDUB", True)
     @patch("auditok.io.BufferAudioSource")
     @genty_dataset(
@@ -294,6 +385,112 @@ class TestIO(TestCase):
             _load_with_pydub(filename, audio_format)
             self.assertTrue(open_func.called)
 
+    @genty_dataset(
+        mono=("mono_400", (400,)),
+        three_channel=("3channel_400-800-1600", (400, 800, 1600)),
+        with_audio_format=("mono_400", (400,), "ogg"),
+    )
+    def test_load_with_ffmpeg(self, file_id, frequencies, audio_format=None):
+        filename = "tests/data/test_16KHZ_{}Hz.wav".format(file_id)
+        with open(filename, "rb") as fp:
+            wave_data = bytearray(fp.read())
+        # ffmpeg can't write actual sizes to the header when output is a pipe
+        wave_data[4:8] = wave_data[40:44] = b"\xff\xff\xff\xff"
+        probe_process = _make_process_mock(0, b"s16\n")
+        decode_process = _make_process_mock(0, bytes(wave_data))
+        with patch("auditok.io.subprocess.Popen") as popen:
+            popen.side_effect = [probe_process, decode_process]
+            audio_source = _load_with_ffmpeg("audio", audio_format)
+        probe_command = popen.call_args_list[0][0][0]
+        decode_command = popen.call_args_list[1][0][0]
+        self.assertEqual(probe_command[0], "ffprobe")
+        self.assertEqual(decode_command[0], "ffmpeg")
+        self.assertEqual(probe_command[-1], "audio")
+        input_index = decode_command.index("-i")
+        self.assertEqual(decode_command[input_index + 1], "audio")
+        if audio_format is None:
+            self.assertNotIn("-f", decode_command[:input_index])
+            self.assertNotIn("-f", probe_command)
+        else:
+            format_index = decode_command.index("-f")
+            self.assertLess(format_index, input_index)
+            self.assertEqual(decode_command[format_index + 1], audio_format)
+            self.assertIn(audio_format, probe_command)
+        audio_source.open()
+        data = audio_source.read(-1)
+        audio_source.close()
+        self.assertIsInstance(audio_source, BufferAudioSource)
+        self.assertIsInstance(audio_source.data, bytes)
+        self.assertEqual(audio_source.sampling_rate, 16000)
+        self.assertEqual(audio_source.sample_width, 2)
+        self.assertEqual(audio_source.channels, len(frequencies))
+        mono_channels = [PURE_TONE_DICT[freq] for freq in frequencies]
+        fmt = FORMAT[audio_source.sample_width]
+        expected = array(fmt, _sample_generator(*mono_channels)).tobytes()
+        self.assertEqual(data, expected)
+
+    @genty_dataset(
+        unsigned_8_bit=("u8", "pcm_u8"),
+        signed_16_bit=("s16p", "pcm_s16le"),
+        signed_32_bit=("s32", "pcm_s32le"),
+        signed_32_bit_planar=("s32p", "pcm_s32le"),
+        float_=("fltp", "pcm_s16le"),
+    )
+    def test_load_with_ffmpeg_keep_bit_depth(self, sample_format, codec):
+        probe_process = _make_process_mock(0, sample_format.encode())
+        # fail decoding, only the command matters here
+        decode_process = _make_process_mock(1, b"")
+        with patch("auditok.io.subprocess.Popen") as popen:
+            popen.side_effect = [probe_process, decode_process]
+            with self.assertRaises(AudioIOError):
+                _load_with_ffmpeg("audio.flac")
+        decode_command = popen.call_args_list[1][0][0]
+        codec_index = decode_command.index("-acodec")
+        self.assertEqual(decode_command[codec_index + 1], codec)
+
+    @genty_dataset(
+        probe_error=(1, b"", 0),
+        no_audio_stream=(0, b"", 0),
+        decode_error=(0, b"s16", 1),
+    )
+    def test_load_with_ffmpeg_error(
+        self, probe_returncode, probe_output, decode_returncode
+    ):
+        probe_process = _make_process_mock(probe_returncode, probe_output)
+        decode_process = _make_process_mock(decode_returncode, b"")
+        with patch("auditok.io.subprocess.Popen") as popen:
+            popen.side_effect = [probe_process, decode_process]
+            with self.assertRaises(AudioIOError):
+                _load_with_ffmpeg("audio.ogg")
+
+    @unittest.skipIf(not _WITH_FFMPEG, "ffmpeg and ffprobe are required")
+    @genty_dataset(
+        flac_16_bit=("s16", 2, 0, "audio.flac", None),
+        flac_24_bit=("s32", 4, 16, "audio.flac", None),
+        flac_no_extension=("s16", 2, 0, "audio", "flac"),
+        flac_wrong_extension=("s16", 2, 0, "audio.mp3", "flac"),
+    )
+    def test_load_with_ffmpeg_real_decoding(
+        self, sample_format, sample_width, shift, filename, audio_format
+    ):
+        tmpdir = TemporaryDirectory()
+        filename = os.path.join(tmpdir.name, filename)
+        input_file = "tests/data/test_16KHZ_3channel_400-800-1600Hz.wav"
+        command = ["ffmpeg", "-v", "quiet", "-i", input_file]
+        command += ["-sample_fmt", sample_format, "-f", "flac", filename]
+        subprocess.check_call(command)
+        audio_source = from_file(filename, audio_format)
+        tmpdir.cleanup()
+        self.assertEqual(audio_source.sampling_rate, 16000)
+        self.assertEqual(audio_source.sample_width, sample_width)
+        self.assertEqual(audio_source.channels, 3)
+        mono_channels = [PURE_TONE_DICT[freq] for freq in (400, 800, 1600)]
+        expected = array(
+            FORMAT[sample_width],
+            (x << shift for x in _sample_generator(*mono_channels)),
+        )
+        self.assertEqual(audio_source.data, expected.tobytes())
+
     @genty_dataset(
         mono=("mono_400Hz.raw", (400,)),
         three_channel=("3channel_400-800-1600Hz.raw", (400, 800, 1600)),
@@ -308,6 +505,20 @@ class TestIO(TestCase):
         _save_raw(data, tmpfile.name)
         self.assertTrue(filecmp.cmp(tmpfile.name, filename, shallow=False))
 
+    @genty_dataset(
+        bytes_=(bytes,),
+        bytearray_=(bytearray,),
+        memoryview_=(memoryview,),
+        array_=(lambda x: x,),
+    )
+    def test_save_raw_bytes_like(self, convert):
+        filename = "tests/data/test_16KHZ_mono_400Hz.raw"
+        data = convert(PURE_TONE_DICT[400])
+        tmpfile = NamedTemporaryFile()
+        with patch("auditok.io._WRITE_CHUNK_SIZE", 1000):
+            _save_raw(data, tmpfile.name)
+        self.assertTrue(filecmp.cmp(tmpfile.name, filename, shallow=False))
+
     @genty_dataset(
         mono=("mono_400Hz.wav", (400,)),
         three_channel=("3channel_400-800-1600Hz.wav", (400, 800, 1600)),
@@ -366,6 +577,8 @@ class TestIO(TestCase):
         wave_with_audio_format=("audio", "wave"),
         wave_with_extension=("audio.wave", None),
         wave_with_audio_format_and_extension=("audio.mp3", "wave"),
+        wav_with_upper_case_audio_format=("audio", "WAV"),
+        wav_with_upper_case_extension=("audio.WAV", None),
     )
     def test_to_file_wave(self, filename, audio_format):
         exp_filename = "tests/data/test_16KHZ_mono_400Hz.wav"
@@ -393,8 +606,9 @@ class TestIO(TestCase):
         del params[missing_param]
         with self.assertRaises(AudioParameterError):
             to_file(b"\0\0", "audio", audio_format="wav", **params)
-        with self.assertRaises(AudioParameterError):
+        with self.assertRaises(AudioParameterError) as ctx:
             to_file(b"\0\0", "audio", audio_format="mp3", **params)
+        self.assertIn("Error detail", str(ctx.exception))
 
     def test_to_file_no_pydub(self):
         with patch("auditok.io._WITH_PYDUB", False):
@@ -442,5 +656,110 @@ class TestIO(TestCase):
         self.assertIsInstance(audio_source, expected_type)
 
 
+def _make_process_mock(returncode, output):
+    """Return a mock of a `subprocess.Popen` object whose `communicate`
+    returns `output` as standard output."""
+    process = Mock(returncode=returncode)
+    process.communicate.return_value = (output, None)
+    return process
+
+
+def _make_pyaudio_mock(played_chunks, max_callbacks=None):
+    """Return a mock of pyaudio module whose output streams run the callback
+    in a thread, the way PortAudio does, and store played chunks. Like
+    PyAudio, streams are aborted if the callback returns non-bytes data. If
+    `max_callbacks` is given, streams become inactive after that many calls
+    to the callback, as if PortAudio aborted them."""
+    pyaudio_mock = Mock(paContinue=0, paComplete=1)
+
+    def open_stream(frames_per_buffer, stream_callback, **kwargs):
+        stream = Mock()
+        active = threading.Event()
+
+        def run_callback():
+            nb_calls = 0
+            while max_callbacks is None or nb_calls < max_callbacks:
+                chunk, flag = stream_callback(None, frames_per_buffer, None, 0)
+                if not isinstance(chunk, bytes):
+                    # PyAudio parses chunks with "z#", which rejects other
+                    # bytes-like objects (e.g. memoryview), and aborts
+                    break
+                played_chunks.append(chunk)
+                nb_calls += 1
+                if flag == pyaudio_mock.paComplete:
+                    break
+            active.clear()
+
+        def start_stream():
+            active.set()
+            threading.Thread(target=run_callback).start()
+
+        stream.start_stream.side_effect = start_stream
+        stream.is_active.side_effect = active.is_set
+        return stream
+
+    pyaudio_mock.PyAudio.return_value.open.side_effect = open_stream
+    return pyaudio_mock
+
+
+@genty
+class TestPyAudioPlayer(TestCase):
+    @genty_dataset(
+        mono=(1, (400,)),
+        three_channel=(3, (400, 800, 1600)),
+    )
+    def test_play(self, channels, frequencies):
+        mono_channels = [PURE_TONE_DICT[freq] for freq in frequencies]
+        data = array("h", _sample_generator(*mono_channels)).tobytes()
+        # make sure last chunk is shorter than the others
+        data = data[: -2 * channels]
+        played_chunks = []
+        pyaudio_mock = _make_pyaudio_mock(played_chunks)
+        with patch.dict(sys.modules, {"pyaudio": pyaudio_mock}):
+            player = PyAudioPlayer(16000, 2, channels)
+        for _ in range(2):
+            played_chunks.clear()
+            player.play(data)
+            self.assertEqual(b"".join(played_chunks), data)
+            chunk_size = 1600 * 2 * channels
+            self.assertEqual(len(played_chunks[0]), chunk_size)
+        self.assertEqual(player.stream.stop_stream.call_count, 2)
+
+    @genty_dataset(
+        bytearray_=(bytearray,),
+        memoryview_=(memoryview,),
+        array_=(lambda data: array("h", data),),
+    )
+    def test_play_bytes_like(self, convert):
+        data = array("h", PURE_TONE_DICT[400]).tobytes()
+        played_chunks = []
+        pyaudio_mock = _make_pyaudio_mock(played_chunks)
+        with patch.dict(sys.modules, {"pyaudio": pyaudio_mock}):
+            player = PyAudioPlayer(16000, 2, 1)
+        player.play(convert(data))
+        for chunk in played_chunks:
+            self.assertIsInstance(chunk, bytes)
+        self.assertEqual(b"".join(played_chunks), data)
+
+    def test_play_stream_stopped_early(self):
+        data = array("h", PURE_TONE_DICT[400]).tobytes()
+        played_chunks = []
+        pyaudio_mock = _make_pyaudio_mock(played_chunks, max_callbacks=2)
+        with patch.dict(sys.modules, {"pyaudio": pyaudio_mock}):
+            player = PyAudioPlayer(16000, 2, 1)
+        # must return even though the callback never reached end of data
+        player.play(data)
+        self.assertEqual(len(played_chunks), 2)
+        self.assertEqual(b"".join(played_chunks), data[: 2 * 1600 * 2])
+        self.assertEqual(player.stream.stop_stream.call_count, 1)
+
+    def test_play_empty_data(self):
+        pyaudio_mock = _make_pyaudio_mock([])
+        with patch.dict(sys.modules, {"pyaudio": pyaudio_mock}):
+            player = PyAudioPlayer(16000, 2, 1)
+        player.play(b"")
+        self.assertFalse(player.stream.start_stream.called)
+
+
 if __name__ == "__main__":
     unittest.main()